@@ -1 +1 @@
-from cbcdb.main import DBManager
\ No newline at end of file
+from cbcdb.main import DBManager, clear_config_cache
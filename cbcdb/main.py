@@ -1,12 +1,136 @@
-import random
+import io
+import logging
+import math
+import re
+import selectors
 import socket
 import time
-from datetime import datetime, date
-from typing import List, Any, Dict, Tuple
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import datetime, date, time as datetime_time
+from decimal import Decimal
+from functools import lru_cache
+from itertools import chain, islice
+from typing import List, Any, Dict, Tuple, Iterator, Iterable, Callable
+from uuid import UUID, uuid4
+
+from threading import Event, Lock
+from weakref import WeakKeyDictionary
 
 from configservice.config import Config
-from psycopg2 import connect
-from psycopg2.extras import execute_values
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.sql import Identifier
+from psycopg2.extras import execute_values, execute_batch as _pg_execute_batch
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# information_schema data types whose values must be quoted, or left unquoted, in generated update statements.
+QUOTED_TYPES = frozenset(['character varying', 'nvarchar', 'text', 'character', 'nchar', 'bpchar', 'date',
+                          'timestamp without time zone', 'timestamp with time zone', 'time without time zone',
+                          'time with time zone'])
+UNQUOTED_TYPES = frozenset(['numeric', 'bigint', 'smallint', 'integer', 'bool', 'float4', 'float8', 'float', 'real',
+                            'double precision', 'boolean'])
+
+# Postgres type OIDs (int2, int4, float4) whose columns fit a narrower numpy dtype than pandas infers for them.
+NARROW_DTYPES = {21: 'int16', 23: 'int32', 700: 'float32'}
+
+# Plain multi-row inserts that insert_many can hand to COPY: insert into <table> (<columns>) values %s
+COPYABLE_INSERT = re.compile(r'^\s*insert\s+into\s+([\w."]+)\s*\(([^)]*)\)\s*values\s*%s\s*;?\s*$', re.IGNORECASE)
+# The single 'values %s' placeholder that execute_values expands into a multi-row VALUES list.
+VALUES_PLACEHOLDER = re.compile(r'\bvalues\s*%s', re.IGNORECASE)
+# Statements that return rows and can be wrapped as a subquery, after any leading comments and parentheses.
+QUERY_STATEMENT = re.compile(r'^\s*(?:--[^\n]*\n\s*|/\*.*?\*/\s*)*[(\s]*(?:select|with|values|table)\b',
+                             re.IGNORECASE | re.DOTALL)
+# The deprecated str.format style placeholders ({} or {0}) accepted by execute_batch.
+FORMAT_PLACEHOLDER = re.compile(r'\{\d*\}')
+# Value types whose str() Postgres parses back to the same value, so rows made only of these can be sent by COPY.
+COPYABLE_TYPES = (str, int, float, Decimal, bool, date, datetime, datetime_time, UUID, type(None))
+# information_schema data types that parse a float's str() (e.g. '0.0') the same way in COPY as in an INSERT.
+FLOAT_TYPES = frozenset(['real', 'double precision', 'numeric'])
+# Characters that must be backslash escaped in COPY text format.
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Config objects shared by every DBManager in the process, keyed on their constructor arguments. With AWS secrets on,
+# building a Config creates a boto3 session and fetches the secret, which is far too slow to repeat per instance.
+_CONFIG_CACHE = {}
+_CONFIG_LOCK = Lock()
+
+
+def _get_config(profile_name, secret_name, use_aws_secrets, region_name, test_mode) -> Config:
+    """
+    Returns a Config for the given settings, building it only the first time those settings are seen in this process.
+
+    Args:
+        profile_name: AWS profile name.
+        secret_name: AWS secret name, or a list of secret names.
+        use_aws_secrets: Read settings from AWS Secrets Manager rather than environment variables.
+        region_name: AWS region the secrets are stored in.
+        test_mode: Config test mode flag.
+
+    Returns: A configservice Config instance.
+    """
+    key = (profile_name, tuple(secret_name) if isinstance(secret_name, list) else secret_name, use_aws_secrets,
+           region_name, test_mode)
+    with _CONFIG_LOCK:
+        config = _CONFIG_CACHE.get(key)
+        if config is None:
+            config = Config(profile_name=profile_name,
+                            secret_name=secret_name,
+                            aws_secrets=use_aws_secrets,
+                            region_name=region_name,
+                            test_mode=test_mode)
+            _CONFIG_CACHE[key] = config
+    return config
+
+
+def clear_config_cache() -> None:
+    """
+    Forgets every cached Config, so the next DBManager that needs one fetches its settings (and secrets) again. Call
+    this after rotating a database secret, such as DB_PASSWORD.
+
+    Returns: None
+    """
+    with _CONFIG_LOCK:
+        _CONFIG_CACHE.clear()
+
+
+def _cache_params(params: Any) -> Any:
+    """
+    Converts query parameters into a hashable value for a result cache key. Unlike repr, which shortens large numpy
+    arrays with '...', this keeps every value, so different parameters never share a key. Scalars are keyed on
+    their type and repr, so that 1, 1.0 and True stay apart.
+
+    Args:
+        params: Parameters for a SQL call.
+
+    Returns: Nested tuples identifying the parameters.
+    """
+    if hasattr(params, 'tolist') and not isinstance(params, str):
+        # numpy arrays and scalars, pandas Series.
+        params = params.tolist()
+    if isinstance(params, (list, tuple)):
+        return tuple(_cache_params(value) for value in params)
+    if isinstance(params, dict):
+        return tuple((repr(key), _cache_params(value)) for key, value in sorted(params.items(), key=repr))
+    return type(params), repr(params)
+
+
+@lru_cache(maxsize=256)
+def _param_string(count: int) -> str:
+    """
+    Returns count %s placeholders separated by commas. Statements are built with the same few arities over and over,
+    so the strings are memoized.
+
+    Args:
+        count: Number of placeholders.
+
+    Returns: A string with parameters represented by %s placeholders.
+    """
+    return ', '.join(['%s'] * count)
 
 
 class DBManager:
@@ -29,11 +153,21 @@ class DBManager:
                  db_schema=None,
                  db_host=None,
                  db_port=None,
-                 test_mode=False):
+                 test_mode=False,
+                 pool_min_conn=1,
+                 pool_max_conn=20,
+                 result_cache_size=128,
+                 fetch_array_size=10000,
+                 insert_page_size=10000):
         """
         Init Function
 
+        Settings that are not passed in are read through a Config shared by every instance with the same AWS
+        settings. Call cbcdb.clear_config_cache() after rotating a secret so new instances pick it up.
+
         Args:
+            aws_cache: Deprecated. Config already fetches and caches all secrets in a single request when
+                       use_aws_secrets is set, so this flag no longer triggers a second fetch.
             debug_output_mode: Flag to turn on debug mode. Setting this to True will print debug messages.
             db_name:
             db_user:
@@ -42,136 +176,447 @@ class DBManager:
             db_host:
             db_port:
             test_mode:
+            pool_min_conn: Number of connections the pool keeps open once it has been created.
+            pool_max_conn: Maximum number of connections the pool will open at once. Raise this if more threads
+                           than this share the instance.
+            result_cache_size: Maximum number of query results kept by the opt-in result cache (see the cache
+                               argument of the read methods). The least recently used result is dropped first.
+            fetch_array_size: Number of rows pulled per round trip when a read method streams its result from a
+                              server-side cursor (stream=True). Larger values mean fewer round trips but more rows held
+                              in memory at once.
+            insert_page_size: Default number of rows insert_many sends in each statement.
         """
-        self._config = Config(profile_name=profile_name,
-                              secret_name=secret_name,
-                              aws_secrets=use_aws_secrets,
-                              region_name=region_name,
-                              test_mode=test_mode)
-        if use_aws_secrets:
-            if aws_cache:
-                self._config.get_all_secrets()
-
-            self._debug_mode = debug_output_mode
-            self._db_host = db_host if db_host else self._config.get_secret('DB_HOST')
-            self._db_name = db_name if db_name else self._config.get_secret('DB_NAME')
-            self._db_user = db_user if db_user else self._config.get_secret('DB_USER')
-            self._db_password = db_password if db_password else self._config.get_secret('DB_PASSWORD')
-            self._db_schema = db_schema if db_schema else self._config.get_secret('DB_SCHEMA')
-            # Publicly accessible schema
-            self.db_schema = self._db_schema
-            if db_port:
-                self._db_port = db_port if db_port else self._config.get_secret('DB_PORT', data_type_convert='int')
-            else:
-                self._db_port = self._config.get_secret('DB_PORT', data_type_convert='int')
-
-            self._page_size = None
-        else:
-            # self._debug_mode = self.debug_output_mode if not debug_output_mode else debug_output_mode
-            self._debug_mode = debug_output_mode
-            self._db_host = db_host if db_host else self._config.get_env('DB_HOST')
-            self._db_name = db_name if db_name else self._config.get_env('DB_NAME')
-            self._db_user = db_user if db_user else self._config.get_env('DB_USER')
-            self._db_password = db_password if db_password else self._config.get_env('DB_PASSWORD')
-            # @todo Implement this as a default schema.
-            self._db_schema = db_schema if db_schema else self._config.get_env('DB_SCHEMA')
-            # Publicly accessible schema
-            self.db_schema = self._db_schema
-            if db_port:
-                self._db_port = db_port if db_port else self._config.get_env('DB_PORT', data_type_convert='bool')
-            else:
-                self._db_port = self._config.get_env('DB_PORT', data_type_convert='bool')
-
-            self._page_size = None
-
-        # Convert DB port if needed.
+        # Config is only built (and secrets only fetched) if one of the connection settings was not passed in.
+        self._config_args = (profile_name, secret_name, use_aws_secrets, region_name, test_mode)
+        if not all([db_host, db_name, db_user, db_password, db_schema, db_port]):
+            # Both sources share the same lookup signature, so pick one once rather than duplicating every lookup.
+            get_value = self._config.get_secret if use_aws_secrets else self._config.get_env
+            db_host = db_host if db_host else get_value('DB_HOST')
+            db_name = db_name if db_name else get_value('DB_NAME')
+            db_user = db_user if db_user else get_value('DB_USER')
+            db_password = db_password if db_password else get_value('DB_PASSWORD')
+            db_schema = db_schema if db_schema else get_value('DB_SCHEMA')
+            db_port = db_port if db_port else get_value('DB_PORT', data_type_convert='int')
+
+        self._debug_mode = debug_output_mode
+        self._db_host = db_host
+        self._db_name = db_name
+        self._db_user = db_user
+        self._db_password = db_password
+        # @todo Implement this as a default schema.
+        self._db_schema = db_schema
+        # Publicly accessible schema
+        self.db_schema = self._db_schema
+        self._db_port = db_port
+
+        # Connections are pooled and reused across calls. The pool is created on first use.
+        self._pool = None
+        self._pool_lock = Lock()
+        self._pool_min_conn = pool_min_conn
+        self._pool_max_conn = pool_max_conn
+        # Number of rows pulled per round trip when streaming from a server-side cursor.
+        self._fetch_array_size = fetch_array_size
+        # Default number of rows per statement for insert_many.
+        self._insert_page_size = insert_page_size
+        # Whether the server is Redshift, looked up on first use. See _is_redshift.
+        self._redshift = None
+        # Table column data types keyed on (schema, table). See invalidate_dtype_cache.
+        self._dtype_cache = {}
+        # Opt-in query result cache, in least to most recently used order. Cleared by every write.
+        self._result_cache = OrderedDict()
+        self._result_cache_size = result_cache_size
+        self._result_cache_lock = Lock()
+        # Bumped by every clear, so a query that was running while a write committed doesn't cache its stale result.
+        self._result_cache_generation = 0
+        # Server-side prepared statements per pooled connection, as {connection: {sql: statement name}}. Entries go
+        # away with their connection.
+        self._prepared = WeakKeyDictionary()
+        self._prepared_lock = Lock()
+
+        # Convert DB port once here (e.g. a port passed in as a string) so connections never need to.
         if not isinstance(self._db_port, int):
             self._db_port = int(self._db_port)
 
+    @property
+    def _config(self) -> Config:
+        """
+        The Config for this instance's settings, shared with every other instance that uses the same settings.
+
+        Returns: A configservice Config instance.
+        """
+        return _get_config(*self._config_args)
+
     def _get_random_port(self, port):
         if port == 'random':
-            while 1 == 1:
-                rand_port = random.randint(5000, 50000)
-                if not self.is_port_in_use(rand_port):
-                    return rand_port
+            # Binding to port 0 lets the kernel hand out a free ephemeral port in one syscall.
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.bind(('localhost', 0))
+                return s.getsockname()[1]
         elif port:
             return int(port)
 
     @staticmethod
     def is_port_in_use(port: int):
+        """
+        Checks if a local port is taken by attempting to bind to it. A bind is a single syscall, unlike a connect
+        which needs a full handshake with whatever is listening.
+        Args:
+            port: The port number to check.
+
+        Returns: True if the port cannot be bound, otherwise False.
+        """
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            return s.connect_ex(('localhost', port)) == 0
+            try:
+                s.bind(('localhost', port))
+            except OSError:
+                return True
+            return False
 
-    def _print_debug_output(self, msg: str):
+    def _print_debug_output(self, msg: str, *args):
         """
-        Prints a debug message if system is in debug mode.
+        Prints a debug message if system is in debug mode. Otherwise the message goes to the module logger at DEBUG
+        level. The message is only formatted if it is actually emitted.
         Args:
-            msg: A string containing the message to print to the logs
+            msg: A string containing the message to print to the logs, with %-style placeholders for args.
+            *args: Values substituted into msg.
 
         Returns: None
 
         """
         if self._debug_mode:
-            print(f'DEBUG: {msg}')
+            print(f'DEBUG: {msg % args if args else msg}')
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(msg, *args)
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        """
+        Returns the connection pool, creating it on first use so that instantiating DBManager never opens a connection.
+
+        Returns: A psycopg2 ThreadedConnectionPool for the configured database.
+        """
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(minconn=self._pool_min_conn,
+                                                        maxconn=self._pool_max_conn,
+                                                        dbname=self._db_name,
+                                                        host=self._db_host,
+                                                        port=self._db_port,
+                                                        user=self._db_user,
+                                                        password=self._db_password)
+        return self._pool
+
+    @contextmanager
+    def _pooled_connection(self):
+        """
+        Checks a connection out of the pool for the duration of the block and runs the block inside a transaction.
+
+        Yields: A psycopg2 connection.
+        """
+        pool = self._get_pool()
+        # Connections the server dropped while they sat in the pool (idle timeouts, restarts, failover, a frozen
+        # Lambda) are discarded and replaced. After a restart every pooled connection may be dead, so keep going until
+        # a live one turns up, at most once per pool slot plus a freshly opened one.
+        for _ in range(self._pool_max_conn + 1):
+            conn = pool.getconn()
+            if not self._is_dropped(conn):
+                break
+            pool.putconn(conn, close=True)
+        else:
+            raise OperationalError('Could not check out a live connection from the pool.')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except (InterfaceError, OperationalError):
+                    # The connection broke mid-block. Let the original error through rather than this one.
+                    pass
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    @staticmethod
+    def _is_dropped(conn) -> bool:
+        """
+        Checks whether an idle connection has been closed by the server, without a round trip. Anything waiting on the
+        socket is peeked at, not read. The connection is dropped if the server hung up, or if it sent an error, which
+        on an idle connection only happens as it terminates the session. Notifications and parameter status messages
+        leave it usable. Over SSL the messages can't be read, so only a hang up is detected.
+
+        Args:
+            conn: An idle psycopg2 connection.
+
+        Returns: True if the connection can no longer be used.
+        """
+        if conn.closed:
+            return True
+        with selectors.DefaultSelector() as selector:
+            selector.register(conn.fileno(), selectors.EVENT_READ)
+            if not selector.select(timeout=0):
+                return False
+        # fromfd works on a duplicate of the descriptor, so closing it leaves the connection alone.
+        with socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                data = sock.recv(65536, socket.MSG_PEEK)
+            except OSError:
+                return True
+        if not data:
+            return True
+        if conn.info.ssl_in_use:
+            return False
+        # Walk the buffered messages: a type byte, then a 4 byte length that counts itself but not the type byte.
+        position = 0
+        while position < len(data):
+            if data[position:position + 1] == b'E':
+                return True
+            position += 1 + int.from_bytes(data[position + 1:position + 5], 'big')
+        return False
+
+    @contextmanager
+    def _acquire(self, curs=False, conn=False, server_side: bool = False):
+        """
+        Yields a connection and a cursor to run a query on.
+
+        A connection is checked out of the pool for the duration of the block, unless the caller handed in its own
+        cursor or connection through the deprecated curs/conn arguments, in which case those are used as-is.
+
+        Args:
+            curs: A cursor supplied by the caller, or False.
+            conn: A connection supplied by the caller, or False.
+            server_side: If True, open a named cursor so Postgres streams the result in batches of
+                         self._fetch_array_size rows instead of sending the whole result set at once.
+
+        Yields: A (connection, cursor) tuple.
+        """
+        if curs or conn:
+            # FutureWarning rather than DeprecationWarning, which Python hides outside __main__, so that callers
+            # passing these from library code see it. Frames: this generator, contextlib's __enter__, the DBManager
+            # method, then the caller.
+            warnings.warn('The curs and conn arguments are deprecated. DBManager manages its own connections.',
+                          FutureWarning, stacklevel=4)
+            if curs:
+                yield conn, curs
+            else:
+                with conn.cursor() as curs:
+                    yield conn, curs
+            return
+        with self._pooled_connection() as conn:
+            with conn.cursor(name=f'cbcdb_{uuid4().hex}' if server_side else None) as curs:
+                if server_side:
+                    curs.itersize = self._fetch_array_size
+                yield conn, curs
+
+    def close(self) -> None:
+        """
+        Closes every pooled connection. The pool is rebuilt automatically if the instance is used again.
+
+        Returns: None
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def __enter__(self) -> 'DBManager':
+        return self
 
-    def _get_connection(self, sql, params, method_instance):
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _execute_prepared(self, curs, sql: str, params: list = None) -> None:
         """
-        Creates a connection to the database
+        Executes sql on curs as a prepared statement, preparing it first if this connection has not seen it before.
+        Prepared statements last for the life of the connection, even if the transaction that prepared them is
+        rolled back.
+
         Args:
-            sql: The original SQL query.
-            params: The original params.
-            method_instance: An instance of the method requesting the database connection.
+            curs: A cursor of a pooled connection.
+            sql: SQL string using %s placeholders.
+            params: List of parameters
 
-        Returns: The results of the original method instance.
+        Returns: None
         """
-        host = self._db_host
-        port = self._db_port
-        return self._database_connection_sub_method(host, port, method_instance, sql, params)
+        with self._prepared_lock:
+            statements = self._prepared.setdefault(curs.connection, {})
+        name = statements.get(sql)
+        if name is None:
+            name = f'cbcdb_{len(statements)}'
+            curs.execute(f'prepare {name} as {self._to_prepared_sql(sql) if params else sql}')
+            statements[sql] = name
+        if params:
+            curs.execute(f'execute {name} ({self.make_param_string(params)})', params)
+        else:
+            curs.execute(f'execute {name}')
+
+    @staticmethod
+    def _to_prepared_sql(sql: str) -> str:
+        """
+        Rewrites psycopg2 style placeholders as Postgres positional parameters for use in PREPARE.
+
+        Args:
+            sql: SQL string using %s placeholders and %% for a literal %.
+
+        Returns: The SQL with each %s replaced by $1, $2, ... and %% by %.
+        """
+        position = 0
+
+        def replace(match):
+            nonlocal position
+            if match.group() == '%%':
+                return '%'
+            position += 1
+            return f'${position}'
 
-    def _database_connection_sub_method(self, host, port, method_instance, sql, params):
-        with connect(dbname=self._db_name,
-                     host=host,
-                     port=port,
-                     user=self._db_user,
-                     password=self._db_password) as conn:
-            with conn.cursor() as curs:
-                return method_instance(sql, params, curs, conn)
+        return re.sub(r'%%|%s', replace, sql)
 
-    def get_sql_dataframe(self, sql: str, params: list = None, curs=False, conn=False):
+    def _get_cached(self, key: tuple, ttl: float, load: Callable[[], Any]) -> Any:
+        """
+        Returns a result from the result cache, calling load and caching its result when the key is missing or the
+        cached result is older than ttl seconds. Callers must copy the result before handing it out.
+
+        Args:
+            key: The cache key, e.g. (method name, sql, _cache_params(params)).
+            ttl: Maximum age in seconds of a cached result, or None for no limit.
+            load: Function that runs the query.
+
+        Returns: The cached or freshly loaded result.
+        """
+        with self._result_cache_lock:
+            entry = self._result_cache.get(key)
+            if entry is not None and (ttl is None or time.monotonic() - entry[0] <= ttl):
+                self._result_cache.move_to_end(key)
+                return entry[1]
+            generation = self._result_cache_generation
+        result = load()
+        with self._result_cache_lock:
+            if generation != self._result_cache_generation:
+                # A write finished while the query ran, so the result may predate it.
+                return result
+            self._result_cache[key] = (time.monotonic(), result)
+            self._result_cache.move_to_end(key)
+            while len(self._result_cache) > self._result_cache_size:
+                self._result_cache.popitem(last=False)
+        return result
+
+    def clear_cache(self) -> None:
+        """
+        Empties the query result cache. Called automatically by every write made through this instance. Call it
+        directly after the data has been changed some other way.
+
+        Returns: None
+        """
+        with self._result_cache_lock:
+            self._result_cache.clear()
+            self._result_cache_generation += 1
+
+    @contextmanager
+    def _invalidating_cache(self):
+        """
+        Clears the result cache when the block exits, after the write inside it has committed (or failed part way).
+        Clearing any earlier would let a concurrent cached read store a result from before the write.
+
+        Yields: None
+        """
+        try:
+            yield
+        finally:
+            self.clear_cache()
+
+    def get_sql_dataframe(self, sql: str, params: list = None, curs=False, conn=False, chunksize: int = None,
+                          cache: bool = False, cache_ttl: float = None, prepare: bool = False,
+                          narrow_dtypes: bool = False):
         """
          Returns a DataFrame for a given SQL query
 
         Args:
             sql: SQL string
             params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            chunksize: If set, rows are streamed from a server-side cursor and an iterator of DataFrames of up to
+                       chunksize rows is returned instead, so the full result never has to fit in memory. The cursor is
+                       opened on a pooled connection, so chunksize can't be combined with curs or conn.
+            cache: If True, serve the result from this instance's result cache when present, and cache it otherwise.
+                   Ignored when chunksize is set.
+            cache_ttl: Maximum age in seconds of a cached result. None means cached results never expire.
+            prepare: If True, run the query as a server-side prepared statement. Each pooled connection prepares a
+                     given SQL string once and then only sends EXECUTE, so Postgres skips parsing and planning.
+                     Parameters take their type from where they are used, so add a cast to placeholders with no
+                     context (select %s::int). Only single SELECT, INSERT, UPDATE, DELETE or VALUES statements with
+                     %s placeholders can be prepared. Ignored when chunksize is set.
+            narrow_dtypes: If True, smallint, integer and real columns are stored as int16, int32 and float32 instead
+                           of 64 bit types, halving or quartering their memory. Integer columns containing nulls are
+                           left as float64.
+
+        Returns: A Pandas DataFrame, or an iterator of DataFrames when chunksize is set.
 
-        Returns: A Pandas DataFrame.
+        """
+        if chunksize:
+            if curs or conn:
+                # A pooled connection wouldn't see the rows written in the caller's open transaction.
+                raise ValueError('chunksize can not be combined with the curs or conn arguments.')
+            return (self._records_to_dataframe(rows, description, narrow_dtypes)
+                    for description, rows in self._iter_batches(sql, params, chunksize))
+        if cache:
+            return self._get_cached(('get_sql_dataframe', sql, _cache_params(params), narrow_dtypes), cache_ttl,
+                                    lambda: self.get_sql_dataframe(sql, params, curs, conn, prepare=prepare,
+                                                                   narrow_dtypes=narrow_dtypes)).copy()
+        with self._acquire(curs, conn) as (conn, curs):
+            self._print_debug_output("Getting query:\n %s", sql)
+            if prepare:
+                self._execute_prepared(curs, sql, params)
+            elif params:
+                curs.execute(sql, params)
+            else:
+                curs.execute(sql)
+            return self._records_to_dataframe(curs.fetchall(), curs.description, narrow_dtypes)
 
+    @staticmethod
+    def _records_to_dataframe(rows: List[tuple], description, narrow_dtypes: bool = False):
+        """
+        Builds a DataFrame from fetched rows. This is what pd.read_sql_query does internally for a DBAPI connection,
+        minus its extra cursor and its SQLAlchemy warning.
+
+        Args:
+            rows: Rows fetched from a cursor.
+            description: The cursor description for the rows.
+            narrow_dtypes: If True, store int2, int4 and float4 columns in the matching narrow numpy dtype.
+
+        Returns: A Pandas DataFrame.
         """
         import pandas as pd
-        if conn:
-            self._print_debug_output(f"Getting query:\n {sql}")
-            if params:
-                df = pd.read_sql_query(sql, params=params, con=conn)
-            else:
-                df = pd.read_sql_query(sql, con=conn)
-        else:
-            df = self._get_connection(sql, params, self.get_sql_dataframe)
+        df = pd.DataFrame.from_records(rows, columns=[column[0] for column in description], coerce_float=True)
+        if narrow_dtypes and df.columns.is_unique:
+            dtypes = {}
+            for column in description:
+                dtype = NARROW_DTYPES.get(column[1])
+                # Nulls force an integer column to float64, which can't be narrowed to an int type.
+                if dtype and (dtype == 'float32' or not df[column[0]].isnull().any()):
+                    dtypes[column[0]] = dtype
+            if dtypes:
+                df = df.astype(dtypes)
         return df
 
-    def get_sql_list_dicts(self, sql: str, params: list = None, curs=False, conn=False) -> List[Dict[str, Any]]:
+    def get_sql_list_dicts(self, sql: str, params: list = None, curs=False, conn=False,
+                           stream: bool = False, cache: bool = False, cache_ttl: float = None,
+                           prepare: bool = False) -> List[Dict[str, Any]]:
         """
         Returns a list of dicts for a given SQL Query
 
         Args:
             sql: SQL string
             params: Parameters for SQL call
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            stream: If True, rows are read through a server-side cursor in batches. The driver never buffers the
+                    whole result set, which keeps memory down on very large queries.
+            cache: If True, serve the result from this instance's result cache when present, and cache it otherwise.
+            cache_ttl: Maximum age in seconds of a cached result. None means cached results never expire.
+            prepare: If True, run the query as a server-side prepared statement (see get_sql_dataframe). Ignored when
+                     stream is set.
 
 
         Returns:
@@ -180,147 +625,496 @@ class DBManager:
              {'more': 'otherdata'}]
 
         """
-        if curs:
-            self._print_debug_output(f"Getting query:\n {sql}")
-            if params:
+        if cache:
+            output = self._get_cached(('get_sql_list_dicts', sql, _cache_params(params)), cache_ttl,
+                                      lambda: self.get_sql_list_dicts(sql, params, curs, conn, stream,
+                                                                      prepare=prepare))
+            return [dict(row) for row in output]
+        with self._acquire(curs, conn, server_side=stream) as (conn, curs):
+            self._print_debug_output("Getting query:\n %s", sql)
+            if prepare and not stream:
+                self._execute_prepared(curs, sql, params)
+            elif params:
                 curs.execute(sql, params)
             else:
                 curs.execute(sql)
-            output = []
+            rows = iter(curs)
+            # A server-side cursor only describes its columns once the first batch has been fetched.
+            first_row = next(rows, None)
+            if first_row is None:
+                return []
             columns = [column[0] for column in curs.description]
-            for row in curs.fetchall():
-                output.append(dict(zip(columns, row)))
-        else:
-            output = self._get_connection(sql, params, self.get_sql_list_dicts)
-        return output
+            return [dict(zip(columns, row)) for row in chain((first_row,), rows)]
+
+    def iter_sql_list_dicts(self, sql: str, params: list = None,
+                            batch_size: int = 10000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yields the results of a SQL Query as lists of dicts, batch_size rows at a time.
+
+        Rows are streamed from a server-side cursor, so only one batch is held in memory and the caller can start
+        processing before the query has finished returning. A pooled connection stays checked out until the generator
+        is exhausted or closed.
+
+        Args:
+            sql: SQL string
+            params: Parameters for SQL call
+            batch_size: Number of rows fetched per round trip and yielded per batch.
+
+        Returns:
+            An iterator of lists of dicts. Example Output:
+            [{'some': 'data'}, {'more': 'otherdata'}], [{'even': 'moredata'}]
+        """
+        columns = None
+        for description, rows in self._iter_batches(sql, params, batch_size):
+            if columns is None:
+                columns = [column[0] for column in description]
+            yield [dict(zip(columns, row)) for row in rows]
+
+    def _iter_batches(self, sql: str, params: list, batch_size: int) -> Iterator[Tuple[tuple, List[tuple]]]:
+        """
+        Runs a query on a server-side cursor and yields its rows batch_size at a time. A pooled connection stays
+        checked out until the generator is exhausted or closed.
+
+        Args:
+            sql: SQL string
+            params: Parameters for SQL call
+            batch_size: Number of rows fetched per round trip.
 
-    def get_sql_single_item_list(self, sql: str, params: list = None, curs=False, conn=False) -> list:
+        Returns:
+            An iterator of (cursor description, rows) tuples.
+        """
+        with self._acquire(server_side=True) as (conn, curs):
+            curs.itersize = batch_size
+            self._print_debug_output("Getting query:\n %s", sql)
+            if params:
+                curs.execute(sql, params)
+            else:
+                curs.execute(sql)
+            while True:
+                rows = curs.fetchmany(batch_size)
+                if not rows:
+                    break
+                # A server-side cursor only describes its columns once the first batch has been fetched.
+                yield curs.description, rows
+
+    def get_sql_single_item_list(self, sql: str, params: list = None, curs=False, conn=False,
+                                 stream: bool = False, cache: bool = False, cache_ttl: float = None,
+                                 prepare: bool = False, column: str = None) -> list:
         """
         Returns a single column list for a given SQL Query
 
         Args:
             sql: SQL string
             params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            stream: If True, rows are read through a server-side cursor in batches. The driver never buffers the
+                    whole result set, which keeps memory down on very large queries.
+            cache: If True, serve the result from this instance's result cache when present, and cache it otherwise.
+            cache_ttl: Maximum age in seconds of a cached result. None means cached results never expire.
+            prepare: If True, run the query as a server-side prepared statement (see get_sql_dataframe). Ignored when
+                     stream is set.
+            column: Name of the column to return. If set, a query is wrapped so only that column is sent back,
+                    rather than fetching every selected column and discarding all but the first. Other statements,
+                    such as an INSERT ... RETURNING, are run as they are and the column is picked from their rows.
 
         Returns: A list containing the results of the query
         """
-        if curs:
-            self._print_debug_output(f"Getting query:\n {sql}")
-            if params:
+        if cache:
+            return list(self._get_cached(('get_sql_single_item_list', sql, _cache_params(params), column), cache_ttl,
+                                         lambda: self.get_sql_single_item_list(sql, params, curs, conn, stream,
+                                                                               prepare=prepare, column=column)))
+        with self._acquire(curs, conn, server_side=stream) as (conn, curs):
+            wrapped = bool(column) and bool(QUERY_STATEMENT.match(sql))
+            if wrapped:
+                sql = self._select_column(sql, column, curs)
+            self._print_debug_output("Getting query:\n %s", sql)
+            if prepare and not stream:
+                self._execute_prepared(curs, sql, params)
+            elif params:
                 curs.execute(sql, params)
             else:
                 curs.execute(sql)
-            output = []
-            for row in curs.fetchall():
-                output.append(row[0])
-        else:
-            output = self._get_connection(sql, params, self.get_sql_single_item_list)
-        return output
+            index = self._column_index(curs, column) if column and not wrapped else 0
+            return [row[index] for row in curs]
 
-    def execute_simple(self, sql: str, params: list = None, curs=False, conn=False):
+    @staticmethod
+    def _select_column(sql: str, column: str, curs) -> str:
+        """
+        Wraps a query so that it only returns one of its columns.
+
+        Args:
+            sql: SQL string of a query.
+            column: Name of the column to keep. It is quoted, so it must match the column name exactly.
+            curs: The cursor the query will run on, used to quote the column name.
+
+        Returns: A SQL string selecting column from the query.
+        """
+        # The query goes on its own lines, so a trailing -- comment can't swallow the closing parenthesis.
+        return f'select {Identifier(column).as_string(curs)} from (\n{sql.strip().rstrip(";")}\n) as _cbcdb_sub'
+
+    @staticmethod
+    def _column_index(curs, column: str) -> int:
+        """
+        Returns the position of a column in the result of the statement last run on curs.
+
+        Args:
+            curs: A cursor that has run a statement returning rows.
+            column: Name of the column.
+
+        Returns: The index of the column in each row.
+        """
+        names = [description[0] for description in curs.description]
+        if column not in names:
+            raise ValueError(f'The column {column} is not in the result, which has columns {names}.')
+        return names.index(column)
+
+    def execute_simple(self, sql: str, params: list = None, curs=False, conn=False, prepare: bool = False):
         """
         Execute as single SQL statement
 
         Args:
             sql: SQL string
             params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            prepare: If True, run the query as a server-side prepared statement. Each pooled connection prepares a
+                     given SQL string once and then only sends EXECUTE, so Postgres skips parsing and planning.
+                     Parameters take their type from where they are used, so add a cast to placeholders with no
+                     context (select %s::int). Only single SELECT, INSERT, UPDATE, DELETE or VALUES statements with
+                     %s placeholders can be prepared.
 
         Returns: None
         """
-        if curs:
-            self._print_debug_output(f"Getting query:\n {sql}")
-            curs.execute(sql, params)
+        with self._invalidating_cache(), self._acquire(curs, conn) as (conn, curs):
+            self._print_debug_output("Getting query:\n %s", sql)
+            if prepare:
+                self._execute_prepared(curs, sql, params)
+            else:
+                curs.execute(sql, params)
             self._print_debug_output('csr.execute complete.')
             conn.commit()
             self._print_debug_output('conn.commit complete.')
-        else:
-            self._get_connection(sql, params, self.execute_simple)
 
-    def get_single_result(self, sql: str, params: list = None, curs=False, conn=False):
+    def get_single_result(self, sql: str, params: list = None, curs=False, conn=False, cache: bool = False,
+                          cache_ttl: float = None, prepare: bool = False, column: str = None):
         """
         Execute as single SQL statement
 
         Args:
             sql: SQL string
             params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            cache: If True, serve the result from this instance's result cache when present, and cache it otherwise.
+            cache_ttl: Maximum age in seconds of a cached result. None means cached results never expire.
+            prepare: If True, run the query as a server-side prepared statement (see get_sql_dataframe).
+            column: Name of the column to return. If set, a query is wrapped so only that column is sent back (see
+                    get_sql_single_item_list).
 
         Returns: None
         """
-        if curs:
-            self._print_debug_output(f"Getting query:\n {sql}")
-            curs.execute(sql, params)
+        if cache:
+            # The value may be mutable (json, arrays), so hand out a copy like the other readers do.
+            return deepcopy(self._get_cached(('get_single_result', sql, _cache_params(params), column), cache_ttl,
+                                             lambda: self.get_single_result(sql, params, curs, conn, prepare=prepare,
+                                                                            column=column)))
+        with self._acquire(curs, conn) as (conn, curs):
+            wrapped = bool(column) and bool(QUERY_STATEMENT.match(sql))
+            if wrapped:
+                sql = self._select_column(sql, column, curs)
+            self._print_debug_output("Getting query:\n %s", sql)
+            if prepare:
+                self._execute_prepared(curs, sql, params)
+            else:
+                curs.execute(sql, params)
             output = curs.fetchone()
-        else:
-            output = self._get_connection(sql, params, self.get_single_result)
-        if isinstance(output, tuple):
-            return output[0]
-        else:
-            return output
+            index = self._column_index(curs, column) if column and not wrapped else 0
+        return output[index] if output is not None else None
 
-    def execute_batch(self, sql: str, params: list, curs=False, conn=False, page_size: int = 1000) -> None:
+    def execute_batch(self, sql: str, params: Iterable, curs=False, conn=False, page_size: int = 1000) -> None:
         """
         Executes batches of SQL Queries
+
+        The SQL should use %s placeholders, which are bound by psycopg2 and sent page_size statements per round trip.
+        SQL using str.format style {} placeholders is still accepted but deprecated, as the values are pasted into the
+        statement unescaped.
+
         Args:
             sql: SQL string
-            params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            params: List or other iterable of parameter rows. Rows are read one page at a time, so a generator
+                    never has to be materialised in full.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
             page_size: Page size controls the number of records pushed in each batch.
 
         Returns: None
         """
-        self._page_size = self._page_size if self._page_size else page_size
+        legacy_format = bool(FORMAT_PLACEHOLDER.search(sql))
+        if legacy_format:
+            warnings.warn('execute_batch with {} placeholders is deprecated. Use %s placeholders instead.',
+                          DeprecationWarning, stacklevel=2)
+        pages = self._iter_pages(params, page_size)
+        first_page = next(pages, None)
+        if first_page is None:
+            # Nothing to send. Skip checking out a connection and the commit round trip.
+            return
         start_time = time.time()
-        params = self.convert_nan_to_none(params)
-        if curs:
-            self._print_debug_output(f"Execute Batches: Inserting {len(params)} records")
-            self._print_debug_output(f"Getting query:\n {sql}")
-            sql_ = []
-            for i in params:
-                sql_.append(sql.format(*i))
-            sql_ = '; '.join(sql_)
-            curs.execute(sql_)
+        row_count = 0
+        with self._invalidating_cache(), self._acquire(curs, conn) as (conn, curs):
+            self._print_debug_output("Getting query:\n %s", sql)
+            for page in chain((first_page,), pages):
+                if not legacy_format:
+                    _pg_execute_batch(curs, sql, page, page_size=page_size)
+                else:
+                    sql_ = []
+                    for i in page:
+                        sql_.append(sql.format(*i))
+                    sql_ = '; '.join(sql_)
+                    curs.execute(sql_)
+                row_count += len(page)
             duration = time.time() - start_time
-            self._print_debug_output(f'Updated {len(params)} rows in {round(duration, 2)} seconds')
+            self._print_debug_output('Updated %d rows in %.2f seconds', row_count, duration)
             conn.commit()
-        else:
-            self._get_connection(sql, params, self.execute_batch)
 
-    def insert_many(self, sql: str, params: list, curs=False, conn=False) -> None:
+    def insert_many(self, sql: str, params: Iterable, curs=False, conn=False, page_size: int = None,
+                    template: str = None, copy_threshold: int = None, parallel: int = 1,
+                    convert_nan: bool = True) -> None:
         """
         Executes a SQL Query
 
         Args:
             sql: SQL string
-            params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            params: List or other iterable of parameter rows. Rows are read one page at a time, so a generator
+                    never has to be materialised in full.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            page_size: Number of rows sent in each statement. Defaults to the instance's insert_page_size.
+            template: Optional row template such as '(%s, %s::date)'. Defaults to one %s per value. Without a
+                      template, SQL that has no 'values %s' placeholder (for example a bulk update or delete) is run
+                      once per row through execute_batch.
+            copy_threshold: If set, lists of more than this many rows are loaded with COPY through bulk_insert_copy
+                            when the SQL is a plain 'insert into table (columns) values %s', every value is a str,
+                            number, bool, date, time, UUID or None, and floats only go to float or numeric columns.
+                            Otherwise the rows are inserted as usual. COPY FROM STDIN is not available on Redshift, so
+                            this is off (None) by default.
+            parallel: Number of pooled connections to insert pages on concurrently, capped at the pool size. If the
+                      pool has fewer free connections, the rows are spread over the ones it has. Each connection
+                      commits its own rows, so if one fails the rows already sent by the others stay committed.
+                      Ignored when a caller cursor or connection is given or the rows are loaded by COPY.
+            convert_nan: If False, rows are sent as given instead of having nan and inf replaced with None. Only pass
+                         False when the rows are known to hold neither.
+
+        Returns: None
+        """
+        if page_size is None:
+            page_size = self._insert_page_size
+        if template is None and not VALUES_PLACEHOLDER.search(sql):
+            # Without a 'values %s' placeholder (updates, deletes, single row inserts) there is nothing for
+            # execute_values to expand, so run the statement once per row through execute_batch instead.
+            self.execute_batch(sql, params, curs, conn, page_size)
+            return
+        if (copy_threshold is not None and not curs and not conn and template is None
+                and isinstance(params, (list, tuple)) and len(params) > copy_threshold):
+            match = COPYABLE_INSERT.match(sql)
+            if match:
+                columns = [column.strip() for column in match.group(2).split(',')]
+                if self._can_copy(match.group(1), columns, params):
+                    self.bulk_insert_copy(match.group(1), columns, params)
+                    return
+        pages = self._iter_pages(params, page_size, convert_nan)
+        first_page = next(pages, None)
+        if first_page is None:
+            # Nothing to send. Skip checking out a connection and the commit round trip.
+            return
+        pages = chain((first_page,), pages)
+        if parallel > 1 and not curs and not conn:
+            with self._invalidating_cache():
+                self._insert_parallel(sql, pages, page_size, template, min(parallel, self._pool_max_conn))
+            return
+        row_count = 0
+        with self._invalidating_cache(), self._acquire(curs, conn) as (conn, curs):
+            start_time = time.time()
+            self._print_debug_output("Getting query:\n %s", sql)
+            for page in pages:
+                execute_values(curs, sql, page, template=template, page_size=page_size)
+                row_count += len(page)
+            duration = time.time() - start_time
+            self._print_debug_output('Inserted %d rows in %.2f seconds', row_count, duration)
+            conn.commit()
+
+    def _can_copy(self, table_name: str, columns: List[str], params: list) -> bool:
+        """
+        Checks whether rows loaded with COPY end up the same as rows inserted with INSERT. Every value must be one of
+        COPYABLE_TYPES, and finite floats may only go to float or numeric columns. COPY reads a float such as 0.0 as
+        the text '0.0', which an integer column rejects, while an INSERT converts it.
+
+        Args:
+            table_name: Name of the target table, optionally schema qualified.
+            columns: Names of the target columns, in the same order as the values in each row.
+            params: List of rows.
+
+        Returns: True if the rows can be sent by COPY.
+        """
+        float_columns = set()
+        for row in params:
+            for column, value in zip(columns, row):
+                if not isinstance(value, COPYABLE_TYPES):
+                    return False
+                # nan and inf are loaded as null, which any column takes.
+                if isinstance(value, float) and math.isfinite(value):
+                    float_columns.add(column)
+        if not float_columns:
+            return True
+        schema, _, table = table_name.rpartition('.')
+        dtypes = self._get_table_dtypes(schema or self._db_schema, table)
+        return all(dtypes.get(column) in FLOAT_TYPES for column in float_columns)
+
+    def _insert_parallel(self, sql: str, pages: Iterator[list], page_size: int, template: str, workers: int) -> None:
+        """
+        Inserts pages of rows from several threads, each holding its own pooled connection and pulling the next page
+        from the shared iterator until it runs out.
+
+        Args:
+            sql: SQL string
+            pages: Iterator of pages of rows, already converted by _iter_pages.
+            page_size: Number of rows sent in each statement.
+            template: Optional row template passed to execute_values.
+            workers: Number of threads and connections to use.
+
+        Returns: None
+        """
+        pages_lock = Lock()
+        # Set when a thread fails, so the others stop taking new pages.
+        failed = Event()
+        # One entry per thread that got a connection.
+        connected = []
+        start_time = time.time()
+        self._print_debug_output("Getting query:\n %s", sql)
+
+        def insert_pages() -> int:
+            row_count = 0
+            try:
+                with self._acquire() as (conn, curs):
+                    connected.append(True)
+                    while not failed.is_set():
+                        with pages_lock:
+                            page = next(pages, None)
+                        if page is None:
+                            break
+                        execute_values(curs, sql, page, template=template, page_size=page_size)
+                        row_count += len(page)
+            except PoolError:
+                # The pool has no connection left for this thread (the caller may be holding some). The threads
+                # that got one insert every page between them.
+                return 0
+            except Exception:
+                failed.set()
+                raise
+            return row_count
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(insert_pages) for _ in range(workers)]
+            row_count = sum(future.result() for future in futures)
+        if not connected:
+            raise PoolError('connection pool exhausted')
+        duration = time.time() - start_time
+        self._print_debug_output('Inserted %d rows in %.2f seconds on %d connections', row_count, duration,
+                                 len(connected))
+
+    def bulk_insert_copy(self, table_name: str, columns: List[str], params: Iterable, schema: str = None,
+                         page_size: int = 10000) -> None:
+        """
+        Loads rows into a table with COPY FROM STDIN, which skips per row statement parsing and is several times faster
+        than INSERT for large loads. Values are sent in COPY text format, so they must be scalars whose str() Postgres
+        can parse (strings, numbers, bools, dates and times). None, nan and inf are loaded as null.
+
+        Args:
+            table_name: Name of the target table
+            columns: Names of the target columns, in the same order as the values in each row.
+            params: List or other iterable of rows.
+            schema: Name of the target schema, or None to use the search path.
+            page_size: Number of rows encoded and sent per COPY.
 
         Returns: None
         """
+        pages = self._iter_pages(params, page_size)
+        first_page = next(pages, None)
+        if first_page is None:
+            return
+        schema = f'{schema}.' if schema else ''
+        sql = f'copy {schema}{table_name} ({self.make_column_names(columns)}) from stdin'
+        row_count = 0
+        with self._invalidating_cache(), self._acquire() as (conn, curs):
+            start_time = time.time()
+            self._print_debug_output("Getting query:\n %s", sql)
+            for page in chain((first_page,), pages):
+                lines = ['\t'.join(['\\N' if value is None else str(value).translate(COPY_ESCAPES) for value in row])
+                         for row in page]
+                lines.append('')
+                curs.copy_expert(sql, io.StringIO('\n'.join(lines)))
+                row_count += len(page)
+            duration = time.time() - start_time
+            self._print_debug_output('Copied %d rows in %.2f seconds', row_count, duration)
+            conn.commit()
+
+    def copy_dataframe(self, df, table_name: str, schema: str = None, page_size: int = 100000) -> None:
+        """
+        Loads a dataframe into a table with COPY FROM STDIN, serialising each page of rows with DataFrame.to_csv instead
+        of converting the frame to Python lists first. The column names of the dataframe must match the column names in
+        the table. NaN, NaT, None and inf are loaded as null, as is a string value of exactly \\N.
 
-        params = self.convert_nan_to_none(params)
-        if curs:
+        Args:
+            df: DataFrame to load.
+            table_name: Name of the target table
+            schema: Name of the target schema, or None to use the search path.
+            page_size: Number of rows serialised and sent per COPY.
+
+        Returns: None
+        """
+        import numpy as np
+        if df.empty:
+            return
+        df = df.replace([np.inf, -np.inf], np.nan)
+        for col in df.columns[df.dtypes.apply(lambda dtype: dtype.kind == 'f')]:
+            # Float columns that only hold whole numbers are usually integer columns that picked up a NaN; write them
+            # without a trailing .0 so Postgres can parse them into integer columns. Values beyond 2**53 are left as
+            # floats, as they can't be cast to Int64 exactly.
+            values = df[col].dropna()
+            if (values % 1 == 0).all() and (values.abs() <= 2 ** 53).all():
+                df[col] = df[col].astype('Int64')
+        schema = f'{schema}.' if schema else ''
+        sql = f"copy {schema}{table_name} ({self.make_column_names(df.columns.tolist())}) from stdin " \
+              f"with (format csv, null '\\N')"
+        with self._invalidating_cache(), self._acquire() as (conn, curs):
             start_time = time.time()
-            self._print_debug_output(f"Execute Many: Inserting {len(params)} records")
-            self._print_debug_output(f"Getting query:\n {sql}")
-            execute_values(curs, sql, params)
+            self._print_debug_output("Getting query:\n %s", sql)
+            for start in range(0, len(df), page_size):
+                buffer = io.StringIO()
+                df.iloc[start:start + page_size].to_csv(buffer, header=False, index=False, na_rep='\\N')
+                buffer.seek(0)
+                curs.copy_expert(sql, buffer)
             duration = time.time() - start_time
-            self._print_debug_output(f'Inserted {len(params)} rows in {round(duration, 2)} seconds')
+            self._print_debug_output('Copied %d rows in %.2f seconds', len(df), duration)
             conn.commit()
-        else:
-            self._get_connection(sql, params, self.insert_many)
+
+    def _iter_pages(self, params: Iterable, page_size: int, convert_nan: bool = True) -> Iterator[list]:
+        """
+        Splits parameter rows into lists of up to page_size rows, with nan and inf converted to None. Only one page is
+        copied and converted at a time.
+
+        Args:
+            params: List or other iterable of parameter rows.
+            page_size: Number of rows per page.
+            convert_nan: If False, pages are yielded without converting nan and inf.
+
+        Returns: An iterator of lists of rows.
+        """
+        rows = iter(params)
+        page = list(islice(rows, page_size))
+        while page:
+            yield self.convert_nan_to_none(page) if convert_nan else page
+            page = list(islice(rows, page_size))
 
     def update_batch_from_df(self, df, update_cols: list, static_cols: list, schema: str,
                              table: str) -> None:
@@ -337,56 +1131,67 @@ class DBManager:
         Returns:
             None
         """
-        import pandas as pd
+        if df.empty:
+            return
         df_ = df[update_cols + static_cols].drop_duplicates()
-        df_ = df_.where(pd.notnull(df_), None)
-        updated_statements = []
-        static_statements = []
-
-        quote_col_dict = self._get_table_column_dtypes(schema, table, list(df_.columns))
-
-        for i in range(len(df_)):
-            updated_col_val = []
-            static_col_val = []
-
-            update_val = df_.loc[i, update_cols].values
-            static_val = df_.loc[i, static_cols].values
-
-            for up_col, up_val in zip(update_cols, update_val):
-                updated_col_val.append(self._set_column_value(up_col, up_val, ',', quote_col_dict))
-            updated_col_val = ''.join(updated_col_val)
-            updated_statements.append(updated_col_val)
-
-            for st_col, st_val in zip(static_cols, static_val):
-                static_col_val.append(self._set_column_value(st_col, st_val, ' and', quote_col_dict))
-            static_col_val = ''.join(static_col_val)
-            static_statements.append(static_col_val)
-
-        updated_statements = [x.rstrip(', ') for x in updated_statements]
-        static_statements = [x.rstrip('and ') for x in static_statements]
+        # Raises if a column is missing from the table or has a type we don't know how to handle.
+        self._get_table_column_dtypes(schema, table, list(df_.columns))
+        dtypes = self._get_table_dtypes(schema, table)
+        # A bare ::character cast means character(1) and would truncate the value, so cast to unbounded bpchar.
+        casts = {col: 'bpchar' if dtypes[col] == 'character' else dtypes[col] for col in df_.columns}
+
+        rows = self.convert_nan_to_none(df_.to_numpy(dtype=object).tolist())
+        if self._is_redshift():
+            # Redshift can't join against a VALUES list, so send one parameterised update per row, batched.
+            set_str = ', '.join([f'{col}=%s' for col in update_cols])
+            where_str = ' and '.join([f'{col}=%s' for col in static_cols])
+            sql = f'update {schema}.{table} set {set_str} where {where_str}'
+            with self._invalidating_cache(), self._acquire() as (conn, curs):
+                self._print_debug_output("Getting query:\n %s", sql)
+                _pg_execute_batch(curs, sql, rows, page_size=self._insert_page_size)
+            return
+
+        # Send every row in a single update joined against a VALUES list, rather than one update statement per row.
+        # Values in a VALUES list have no declared type (an all null column would be text), so each one is cast to
+        # the column's type in the table.
+        set_str = ', '.join([f'{col}=v.{col}::{casts[col]}' for col in update_cols])
+        where_str = ' and '.join([f't.{col}=v.{col}::{casts[col]}' for col in static_cols])
+        sql = (f'update {schema}.{table} as t set {set_str} '
+               f'from (values %s) as v ({self.make_column_names(update_cols + static_cols)}) where {where_str}')
+        with self._invalidating_cache(), self._acquire() as (conn, curs):
+            self._print_debug_output("Getting query:\n %s", sql)
+            execute_values(curs, sql, rows, page_size=self._insert_page_size)
+
+    def _is_redshift(self) -> bool:
+        """
+        Checks whether the server is Amazon Redshift, which lacks some Postgres features. The answer is looked up
+        once per instance.
 
-        sql = []
-        for ss, us in zip(static_statements, updated_statements):
-            sql.append(f"""update {schema}.{table} set  {us} where {ss};""")
-        sql = ' '.join(sql)
-        self.execute_simple(sql)
+        Returns: True if the server is Redshift.
+        """
+        if self._redshift is None:
+            self._redshift = 'redshift' in self.get_single_result('select version()').lower()
+        return self._redshift
 
     # look up alias decorator
-    def execute_many(self, sql: str, params: list, curs=False, conn=False) -> None:
+    def execute_many(self, sql: str, params: list, curs=False, conn=False, page_size: int = None,
+                     copy_threshold: int = None) -> None:
         """
         Executes a SQL Query
 
         Args:
             sql: SQL string
             params: List of parameters
-            curs: An instance of a database cursor. Will be false when method is first called, then populated when
-                  method is called recursively.
-            conn: An instance of a database connection or false on first call.
+            curs: Deprecated. An existing cursor to run the query on instead of a pooled connection.
+            conn: Deprecated. An existing connection to run the query on instead of a pooled connection.
+            page_size: Number of rows sent in each statement. Defaults to the instance's insert_page_size.
+            copy_threshold: If set, large plain inserts are loaded with COPY (see insert_many). Off by default.
 
         Returns: None
         """
-        print("Warning: execute_many will be deprecated. Please use insert_many instead.")
-        self.insert_many(sql, params, curs, conn)
+        warnings.warn('execute_many will be deprecated. Please use insert_many instead.', DeprecationWarning,
+                      stacklevel=2)
+        self.insert_many(sql, params, curs, conn, page_size=page_size, copy_threshold=copy_threshold)
 
     def delete(self, sql: str, params: list):
         """
@@ -398,7 +1203,7 @@ class DBManager:
 
         Returns: None
         """
-        print('WARNING: Depreciated function. Use execute_simple.')
+        warnings.warn('delete is deprecated. Use execute_simple.', DeprecationWarning, stacklevel=2)
         self.execute_simple(sql, params)
 
     # Section Utility methods
@@ -418,24 +1223,16 @@ class DBManager:
         Returns:
             A dict where 1 = quoted, 0 = unquoted. Structure: {'id': 0, 'name': 1, 'age': 0, 'start_date': 1}
         """
-        sql = f"""select column_name, data_type from information_schema.columns
-                  where table_schema = '{schema}' and table_name = '{table}';"""
-        res = self.get_sql_list_dicts(sql)
-        dtypes = {x['column_name']: x['data_type'] for x in res}
-        quoted_types = ['character varying', 'nvarchar', 'text', 'character', 'nchar', 'bpchar', 'date',
-                        'timestamp without time zone', 'timestamp with time zone', 'time without time zone',
-                        'time with time zone']
-        unquoted_types = ['numeric', 'bigint', 'smallint', 'integer', 'bool', 'float4', 'float8', 'float', 'real',
-                          'double precision', 'boolean']
+        dtypes = self._get_table_dtypes(schema, table)
         output = {}
         for col in columns:
             quote_val = None
             dtype = dtypes.get(col)
             if not dtype:
                 raise MissingDatabaseColumn(f'The column {col} was not found in the {table} table.')
-            if dtype in quoted_types:
+            if dtype in QUOTED_TYPES:
                 quote_val = 1
-            elif dtype in unquoted_types:
+            elif dtype in UNQUOTED_TYPES:
                 quote_val = 0
             else:
                 raise MissingDTypeFromTypes(f'The column {col} in {table} table has a data type of {dtype}.'
@@ -443,6 +1240,35 @@ class DBManager:
             output[col] = quote_val
         return output
 
+    def _get_table_dtypes(self, schema: str, table: str) -> Dict[str, str]:
+        """
+        Returns the information_schema data type of every column in a table. Results are cached per instance, so the
+        catalog is only queried once per table. Call invalidate_dtype_cache after altering a table.
+
+        Args:
+            schema: The name of the schema to query.
+            table: The name of the table to query.
+
+        Returns:
+            A dict of column name to data type. Structure: {'id': 'integer', 'name': 'text'}
+        """
+        dtypes = self._dtype_cache.get((schema, table))
+        if dtypes is None:
+            sql = """select column_name, data_type from information_schema.columns
+                     where table_schema = %s and table_name = %s;"""
+            res = self.get_sql_list_dicts(sql, [schema, table])
+            dtypes = {x['column_name']: x['data_type'] for x in res}
+            self._dtype_cache[(schema, table)] = dtypes
+        return dtypes
+
+    def invalidate_dtype_cache(self) -> None:
+        """
+        Forgets the cached table column data types, e.g. after a migration has altered a table.
+
+        Returns: None
+        """
+        self._dtype_cache.clear()
+
     @staticmethod
     def make_column_names(columns: List[str]) -> str:
         """
@@ -464,14 +1290,7 @@ class DBManager:
 
         Returns: A string with parameters represented by %s placeholders.
         """
-        list_len = len(input_list)
-        param_string = ""
-        x = 0
-        while x < list_len:
-            param_string += '%s, '
-            x += 1
-        param_string = param_string[:-2]
-        return param_string
+        return _param_string(len(input_list))
 
     def make_variable_replacements(self, input_list: List[str]) -> str:
         """
@@ -484,7 +1303,8 @@ class DBManager:
 
         Returns: A string with parameters represented by %s placeholders.
         """
-        print('make_variable_replacements has been depreciated and will be removed in a future version.')
+        warnings.warn('make_variable_replacements has been deprecated and will be removed in a future version. '
+                      'Use make_param_string instead.', DeprecationWarning, stacklevel=2)
         return self.make_param_string(input_list)
 
     def build_sql_from_dataframe(self, df, table_name: str, schema: str) -> Tuple[str, list]:
@@ -501,28 +1321,53 @@ class DBManager:
             A sql string template for the insert statement.
             A list of params
         """
-        import pandas as pd
-        columns = list(df.columns)
+        columns = df.columns.tolist()
         columns_str = self.make_column_names(columns)
         schema = f'{schema}.' if schema else ''
         sql = f'insert into {schema}{table_name} ({columns_str}) values %s;'
-        vals = list(df.values)
-        # This returns a list of arrays. Need to convert to list of lists.
-        params = [list(x) for x in vals]
+        # Converting through an object array keeps each column's own type (ints stay ints next to float columns) and
+        # yields native Python scalars in a single pass.
+        params = df.to_numpy(dtype=object).tolist()
         return sql, params
 
-    def save_dataframe(self, df, table_name: str, schema: str) -> None:
+    def save_dataframe(self, df, table_name: str, schema: str, copy_threshold: int = None) -> None:
         """
         Saves a dataframe to a table in redshift/postgres.
         Args:
             df: DataFrame to use for SQL call
             table_name: Name of the target table
             schema: Name of the target schema.
+            copy_threshold: If set, frames with more than this many rows are loaded with COPY through
+                copy_dataframe. COPY FROM STDIN is not available on Redshift, so the default (None) always inserts.
         Returns:
             None
         """
+        if copy_threshold is not None and len(df) > copy_threshold:
+            self.copy_dataframe(df, table_name, schema)
+            return
         sql, params = self.build_sql_from_dataframe(df, table_name, schema)
-        self.insert_many(sql, params)
+        self.insert_many(sql, params, copy_threshold=copy_threshold, convert_nan=self._has_nan_or_inf(df))
+
+    @staticmethod
+    def _has_nan_or_inf(df) -> bool:
+        """
+        Checks a dataframe for missing or infinite values column by column, which is far cheaper than scanning the
+        rows built from it cell by cell.
+
+        Args:
+            df: DataFrame to check.
+
+        Returns: True if any value is null, nan, NaT, inf or -inf.
+        """
+        import numpy as np
+        if df.isna().to_numpy().any():
+            return True
+        numeric = df.select_dtypes(include='number')
+        if not np.isfinite(numeric.to_numpy(dtype=np.float64)).all():
+            return True
+        # Object columns can still hold float infinities.
+        objects = df.select_dtypes(include='object')
+        return bool(objects.isin([np.inf, -np.inf]).to_numpy().any())
 
     @staticmethod
     def convert_nan_to_none(params: List[Any]) -> List[Any]:
@@ -536,26 +1381,53 @@ class DBManager:
 
         Returns: A list of parameters with pd.nan's converted to None
         """
+        import numpy as np
         import pandas as pd
         from numpy import inf
-        row_counter = 0
-        for row in params:
-            value_counter = 0
+        if len(params) and isinstance(params[0], (list, tuple)):
+            values = np.array(params, dtype=object)
+            # Ragged rows or array-valued cells don't form a 2-D grid. Those fall through to the row-by-row loop below.
+            if values.ndim == 2:
+                try:
+                    # Numeric grids take a single isfinite pass, which flags NaN, inf, -inf and None together. The
+                    # float conversion also parses strings such as 'nan', so the flagged cells are confirmed below.
+                    mask = ~np.isfinite(values.astype(np.float64))
+                except (TypeError, ValueError, OverflowError):
+                    mask = None
+                if mask is not None:
+                    candidates = values[mask]
+                    mask[mask] = pd.isnull(candidates) | (candidates == inf) | (candidates == -inf)
+                    values[mask] = None
+                    return values.tolist()
+
+                # Build the masks over the whole grid at once rather than calling pd.isnull once per value.
+                mask = pd.isnull(values)
+                # A note on inf. inf, or np.inf shows up sometimes. It can be positive or negative (oddly).
+                # It's important to remove this or SQL Server will throw an error about floating point precision.
+                # Only non-null cells are compared; comparing pd.NA returns NA instead of a bool.
+                not_null = ~mask
+                candidates = values[not_null]
+                mask[not_null] = (candidates == inf) | (candidates == -inf)
+                values[mask] = None
+                return values.tolist()
+
+        # Bind the lookups used per value to locals for the row-by-row loop.
+        isnull = pd.isnull
+        neg_inf = -inf
+        for i, row in enumerate(params):
             if isinstance(row, list):
-                for v in row:
+                for j, v in enumerate(row):
+                    v_type = type(v)
+                    if v_type is str or v_type is int or v is None:
+                        # Can't be nan or inf. Skipping these avoids the comparatively slow pd.isnull call.
+                        continue
                     # A note on inf. inf, or np.inf shows up sometimes. It can be positive or negative (oddly).
                     # It's important to remove this or SQL Server will throw an error about floating point precision.
-                    if pd.isnull(v) or v == inf or v == -inf:
-                        row[value_counter] = None
-                    value_counter += 1
-                params[row_counter] = row
-            else:
+                    if isnull(v) or v == inf or v == neg_inf:
+                        row[j] = None
+            elif isnull(row):
                 # The params are not a multi-dimensional list.
-                if pd.isnull(row):
-                    row = None
-                params[row_counter] = row
-
-            row_counter += 1
+                params[i] = None
         return params
 
     @staticmethod
@@ -563,6 +1435,9 @@ class DBManager:
         """
         Returns a string for the "set" section of the update statement in the appropriate format based on datatype.
 
+        No longer used by update_batch_from_df, which now binds its values. Kept for backward compatibility with
+        callers that build their own update statements.
+
         Args:
             col: The name of the column. i.e. 'first_name'
             val: The value, i.e. 'Craig'
@@ -1,9 +1,16 @@
 # import psycopg2
 import random
+import time
 from unittest import TestCase
 from datetime import datetime, date
+from decimal import Decimal
+import numpy as np
 import pandas as pd
 import pytz
+from psycopg2 import OperationalError
+from psycopg2.extensions import AsIs
+from psycopg2.pool import PoolError
+from cbcdb import main as cbcdb_main, clear_config_cache
 from cbcdb.main import DBManager, MissingDatabaseColumn, MissingDTypeFromTypes
 from tests.docker_test_setup import start_pg_container
 
@@ -101,6 +108,24 @@ class TestDBManager(TestCase):
         test = res.iloc[0]['color_name']
         self.assertEqual(golden, test)
 
+        # Chunked
+        chunks = list(db.get_sql_dataframe(f'select * from {table_name} order by id', chunksize=4))
+        self.assertEqual([4, 2], [len(x) for x in chunks])
+        self.assertEqual(list(res.columns), list(chunks[1].columns))
+        self.assertEqual('cyan', chunks[1].iloc[1]['color_name'])
+
+        # Chunks are read on a pooled connection, which can't see a caller's uncommitted rows
+        with db._pooled_connection() as conn:
+            with self.assertRaises(ValueError):
+                db.get_sql_dataframe(f'select * from {table_name}', conn=conn, chunksize=4)
+
+        # Narrow dtypes
+        sql = 'select 1::int2 as a, 2::int4 as b, 1.5::float4 as c, 3::int8 as d, null::int4 as e'
+        res = db.get_sql_dataframe(sql, narrow_dtypes=True)
+        self.assertEqual(['int16', 'int32', 'float32', 'int64', 'object'], [str(x) for x in res.dtypes])
+        self.assertEqual(['int64', 'int64', 'float64', 'int64', 'object'],
+                         [str(x) for x in db.get_sql_dataframe(sql).dtypes])
+
         # @todo test with params.
 
     def test__get_sql_list_dicts(self):
@@ -112,6 +137,30 @@ class TestDBManager(TestCase):
         test = res[0]['color_name']
         self.assertEqual(golden, test)
 
+        # Streaming through a server-side cursor returns the same rows
+        self.assertEqual(res, db.get_sql_list_dicts(f'select * from {table_name}', stream=True))
+        self.assertEqual([], db.get_sql_list_dicts(f'select * from {table_name} where id < 0', stream=True))
+
+        # Several round trips with a small fetch size
+        db = DBManager(db_port=5434, db_name='test', db_user='test', db_password='test', db_schema='public',
+                       db_host='localhost', fetch_array_size=4)
+        self.assertEqual(res, db.get_sql_list_dicts(f'select * from {table_name}', stream=True))
+
+    def test__iter_sql_list_dicts(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db)
+
+        batches = list(db.iter_sql_list_dicts(f'select * from {table_name} order by id', batch_size=4))
+        self.assertEqual([4, 2], [len(x) for x in batches])
+        self.assertEqual('red', batches[0][0]['color_name'])
+        self.assertEqual('cyan', batches[1][1]['color_name'])
+
+        # Closing the generator early hands the connection back to the pool.
+        batches = db.iter_sql_list_dicts(f'select * from {table_name}', batch_size=1)
+        next(batches)
+        batches.close()
+        self.assertEqual(6, db.get_single_result(f'select count(*) from {table_name}'))
+
     def test__get_sql_single_item_list(self):
         db = self._get_db_inst()
         table_name = self._prepare_test_table(db)
@@ -120,6 +169,27 @@ class TestDBManager(TestCase):
         test = res[0]
         self.assertEqual(golden, test)
 
+        # Streaming through a server-side cursor returns the same rows
+        self.assertEqual(res, db.get_sql_single_item_list(f'select color_name from {table_name}', stream=True))
+
+        # Only the named column is selected
+        self.assertEqual(res, db.get_sql_single_item_list(f'select * from {table_name};', column='color_name'))
+        self.assertEqual('green', db.get_single_result(f'select * from {table_name} where id = %s', [2],
+                                                       column='color_name'))
+        self.assertEqual(2, db.get_single_result('select 1 as a, 2 as b -- trailing', column='b'))
+        self.assertEqual(1, db.get_single_result('select 1 as "Order", 2 as b', column='Order'))
+        self.assertEqual(['red'], db.get_sql_single_item_list(f'select id, color_name as "select" from {table_name} '
+                                                              f'where id = 1', column='select', stream=True))
+
+        # Statements other than queries aren't wrapped, and the column is picked from the rows they return
+        res = db.get_sql_single_item_list(f"insert into {table_name} (color_name) values ('x'), ('y') "
+                                          f"returning id, color_name", column='color_name')
+        self.assertEqual(['x', 'y'], res)
+        self.assertEqual('z', db.get_single_result(f"update {table_name} set color_name = 'z' where color_name = 'y' "
+                                                   f"returning id, color_name", column='color_name'))
+        with self.assertRaises(ValueError):
+            db.get_single_result(f"delete from {table_name} where color_name = 'z' returning id", column='missing')
+
     def test__execute_simple(self):
         db = self._get_db_inst()
         table_name = self._prepare_test_table(db)
@@ -133,6 +203,150 @@ class TestDBManager(TestCase):
         test = res[len(res) - 1]
         self.assertEqual(golden, test)
 
+    def test__close(self):
+        db = self._get_db_inst()
+        self.assertIsNone(db._pool)
+
+        # Connections are pooled, so consecutive calls are served by the same backend.
+        pid = db.get_single_result('select pg_backend_pid()')
+        self.assertEqual(pid, db.get_single_result('select pg_backend_pid()'))
+
+        db.close()
+        self.assertIsNone(db._pool)
+
+        # The pool is rebuilt on the next call.
+        self.assertEqual(1, db.get_single_result('select 1'))
+
+        # A pooled connection the server has dropped is replaced on checkout
+        pid = db.get_single_result('select pg_backend_pid()')
+        other = self._get_db_inst()
+        other.get_single_result('select pg_terminate_backend(%s)', [pid])
+        other.close()
+        time.sleep(0.1)
+        self.assertNotEqual(pid, db.get_single_result('select pg_backend_pid()'))
+
+        # A notification waiting on a healthy connection doesn't get it replaced
+        db.execute_simple('listen cbcdb_test')
+        pid = db.get_single_result('select pg_backend_pid()')
+        other = self._get_db_inst()
+        other.execute_simple("notify cbcdb_test, 'payload'")
+        other.close()
+        time.sleep(0.1)
+        self.assertEqual(pid, db.get_single_result('select pg_backend_pid()'))
+
+        # If no live connection turns up, checkout fails instead of handing out a dead one
+        db._is_dropped = lambda conn: True
+        with self.assertRaises(OperationalError):
+            db.get_single_result('select 1')
+        del db._is_dropped
+        self.assertEqual(1, db.get_single_result('select 1'))
+        db.close()
+
+        # Pool size is configurable
+        db = DBManager(db_port=5434, db_name='test', db_user='test', db_password='test', db_schema='public',
+                       db_host='localhost', pool_min_conn=2, pool_max_conn=3)
+        self.assertEqual(1, db.get_single_result('select 1'))
+        self.assertEqual((2, 3), (db._pool.minconn, db._pool.maxconn))
+        db.close()
+
+        # Used as a context manager, the pool is closed on exit
+        with self._get_db_inst() as db:
+            self.assertEqual(1, db.get_single_result('select 1'))
+            self.assertIsNotNone(db._pool)
+        self.assertIsNone(db._pool)
+
+    def test__config_cache(self):
+        # Instances with the same settings share one Config, so secrets are only fetched once per process.
+        db_a = self._get_db_inst()
+        db_b = self._get_db_inst()
+        self.assertIs(db_a._config, db_b._config)
+
+        # Config is not built at all when every connection setting is passed in
+        DBManager(use_aws_secrets=False, secret_name='unused_secret', db_port=5434, db_name='test', db_user='test',
+                  db_password='test', db_schema='public', db_host='localhost')
+        self.assertFalse([key for key in cbcdb_main._CONFIG_CACHE if key[1] == 'unused_secret'])
+
+        # Clearing the cache makes the next instance build a fresh Config, e.g. to pick up a rotated secret
+        config = db_a._config
+        clear_config_cache()
+        self.assertIsNot(config, self._get_db_inst()._config)
+
+    def test__result_cache(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db)
+        sql = f'select color_name from {table_name} where id = %s'
+
+        def rename_behind_cache(name):
+            # Change the data without going through DBManager, so the cache is not cleared.
+            with db._pooled_connection() as conn:
+                with conn.cursor() as curs:
+                    curs.execute(f'update {table_name} set color_name = %s where id = 1', [name])
+
+        self.assertEqual('red', db.get_single_result(sql, [1], cache=True))
+        rename_behind_cache('maroon')
+        self.assertEqual('red', db.get_single_result(sql, [1], cache=True))
+        self.assertEqual([{'color_name': 'maroon'}], db.get_sql_list_dicts(sql, [1], cache=True))
+        self.assertEqual('maroon', db.get_single_result(sql, [1], cache=True, cache_ttl=0))
+
+        # Callers get copies, so mutating a result does not change the cache.
+        db.get_sql_list_dicts(sql, [1], cache=True)[0]['color_name'] = 'changed'
+        self.assertEqual([{'color_name': 'maroon'}], db.get_sql_list_dicts(sql, [1], cache=True))
+        db.get_sql_single_item_list(sql, [1], cache=True).append('changed')
+        self.assertEqual(['maroon'], db.get_sql_single_item_list(sql, [1], cache=True))
+        db.get_single_result("select '{\"a\": 1}'::json", cache=True)['a'] = 2
+        self.assertEqual({'a': 1}, db.get_single_result("select '{\"a\": 1}'::json", cache=True))
+
+        # Keys hold every parameter value, even where repr would elide part of a large array.
+        big, other = np.arange(2000), np.arange(2000)
+        other[1000] = -1
+        self.assertEqual(repr(big), repr(other))
+        self.assertNotEqual(cbcdb_main._cache_params([big]), cbcdb_main._cache_params([other]))
+        self.assertNotEqual(cbcdb_main._cache_params([1]), cbcdb_main._cache_params([True]))
+
+        # Writes through the instance clear the cache.
+        db.execute_simple(f"update {table_name} set color_name = 'scarlet' where id = 1")
+        self.assertEqual('scarlet', db.get_sql_dataframe(sql, [1], cache=True).iloc[0]['color_name'])
+        rename_behind_cache('crimson')
+        db.clear_cache()
+        self.assertEqual('crimson', db.get_sql_dataframe(sql, [1], cache=True).iloc[0]['color_name'])
+
+        # A result loaded while a write finished is returned but not cached.
+        def load_during_write():
+            result = db.get_single_result(sql, [1])
+            db.execute_simple(f"update {table_name} set color_name = 'rose' where id = 1")
+            return result
+
+        self.assertEqual('crimson', db._get_cached(('race',), None, load_during_write))
+        self.assertNotIn(('race',), db._result_cache)
+
+        # Least recently used results are dropped once the cache is full.
+        db._result_cache_size = 2
+        for i in range(1, 4):
+            db.get_single_result(sql, [i], cache=True)
+        self.assertEqual(2, len(db._result_cache))
+
+    def test__prepared_statements(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db)
+        self.assertEqual("select $1 where name like 'a%' and id = $2", db._to_prepared_sql(
+            "select %s where name like 'a%%' and id = %s"))
+
+        sql = f'insert into {table_name} (color_name, an_int) values (%s, %s)'
+        db.execute_simple(sql, ['teal', 1], prepare=True)
+        db.execute_simple(sql, ['gold', 2], prepare=True)
+        sql = f'select color_name from {table_name} where an_int >= %s order by an_int'
+        self.assertEqual(['teal', 'gold'], db.get_sql_dataframe(sql, [1], prepare=True)['color_name'].tolist())
+        self.assertEqual(['gold'], db.get_sql_dataframe(sql, [2], prepare=True)['color_name'].tolist())
+        self.assertEqual([{'color_name': 'gold'}], db.get_sql_list_dicts(sql, [2], prepare=True))
+        self.assertEqual(['teal', 'gold'], db.get_sql_single_item_list(sql, [1], prepare=True))
+        self.assertEqual(['gold'], db.get_sql_single_item_list(sql, [2], stream=True, prepare=True))
+        self.assertEqual(2, db.get_single_result(f'select count(*) from {table_name} where an_int >= %s', [1],
+                                                 prepare=True))
+
+        # Each statement was prepared once on the pooled connection
+        prepared = db.get_sql_single_item_list('select statement from pg_prepared_statements order by name')
+        self.assertEqual(3, len(prepared))
+
     def test__get_single_result(self):
         db = self._get_db_inst()
         table_name = self._prepare_test_table(db)
@@ -140,6 +354,19 @@ class TestDBManager(TestCase):
         golden = 'red'
         self.assertEqual(golden, test)
 
+        # A caller supplied connection still works, but is deprecated
+        with db._pooled_connection() as conn:
+            with self.assertWarns(FutureWarning) as cm:
+                test = db.get_single_result(f'select color_name from {table_name}', conn=conn)
+        self.assertEqual(golden, test)
+        self.assertEqual(__file__, cm.filename)
+
+        # With debug output off, messages go to the module logger
+        db._debug_mode = False
+        with self.assertLogs('cbcdb.main', level='DEBUG') as cm:
+            db.get_single_result('select %s', [1])
+        self.assertEqual(['DEBUG:cbcdb.main:Getting query:\n select %s'], cm.output)
+
     def test__execute_batch(self):
         db = self._get_db_inst()
         table_name = self._prepare_test_table(db, True)
@@ -160,6 +387,20 @@ class TestDBManager(TestCase):
         sql = "update public.color set color_name='{0}', another_value='{1}' where id={2}"
         db.execute_batch(sql, params)
 
+        sql = 'update public.color set color_name=%s, another_value=%s where id=%s'
+        params = [('batch_a', 'x', 1), ('batch_b', 'y', 2)]
+        db.execute_batch(sql, params)
+        result = db.get_sql_list_dicts('select color_name, another_value from public.color '
+                                       'where id in (1, 2) order by id')
+        self.assertEqual([{'color_name': 'batch_a', 'another_value': 'x'},
+                          {'color_name': 'batch_b', 'another_value': 'y'}], result)
+
+        # Legacy {} placeholders are detected directly, so a literal % in the SQL doesn't switch to %s binding
+        db.execute_simple("update public.color set color_name = 'goldsmith' where id = 3")
+        with self.assertWarns(DeprecationWarning):
+            db.execute_batch("update public.color set color_name = '{}' where color_name like '%smith'", [['x']])
+        self.assertEqual('x', db.get_single_result('select color_name from public.color where id = 3'))
+
         # # Syntax error (intos vs into)
         # sql = 'insert intos public.color (color_name) values %s;'
         # failed = False
@@ -169,6 +410,152 @@ class TestDBManager(TestCase):
         #     failed = True
         # self.assertTrue(failed)
 
+    def test__insert_many(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db, True)
+
+        params = [[f'color_{i}', str(i)] for i in range(25)]
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s', params, page_size=10)
+        self.assertEqual(25, db.get_single_result(f'select count(*) from public.{table_name}'))
+
+        # The default page size comes from the instance
+        small_pages = DBManager(db_port=5434, db_name='test', db_user='test', db_password='test', db_schema='public',
+                                db_host='localhost', insert_page_size=10)
+        self.assertEqual(3, len(list(small_pages._iter_pages(params, small_pages._insert_page_size))))
+
+        # Any iterable of rows, converting nan page by page
+        db.insert_many(f'insert into public.{table_name} (color_name, a_number) values %s',
+                       ((f'gen_{i}', np.nan if i % 2 else 1.5) for i in range(25)), page_size=10)
+        result = db.get_single_result(f"select count(a_number) from public.{table_name} where color_name like 'gen_%%'")
+        self.assertEqual(13, result)
+        db.execute_simple(f"delete from public.{table_name} where color_name like 'gen_%%'")
+
+        # Parallel inserts over several pooled connections
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s',
+                       [[f'par_{i}', str(i)] for i in range(95)], page_size=10, parallel=4)
+        result = db.get_sql_single_item_list(f"select another_value::int from public.{table_name} "
+                                             f"where color_name like 'par_%%' order by 1")
+        self.assertEqual(list(range(95)), result)
+        db.execute_simple(f"delete from public.{table_name} where color_name like 'par_%%'")
+
+        # Connections already checked out leave fewer for the threads, which share the rows between the ones they get
+        small_pool = DBManager(db_port=5434, db_name='test', db_user='test', db_password='test', db_schema='public',
+                               db_host='localhost', pool_max_conn=3)
+        sql = f'insert into public.{table_name} (color_name, another_value) values %s'
+        with small_pool._pooled_connection(), small_pool._pooled_connection():
+            small_pool.insert_many(sql, [[f'par_{i}', str(i)] for i in range(95)], page_size=10, parallel=3)
+            with small_pool._pooled_connection():
+                with self.assertRaises(PoolError):
+                    small_pool.insert_many(sql, [['none_left', '0']], parallel=2)
+        result = db.get_sql_single_item_list(f"select another_value::int from public.{table_name} "
+                                             f"where color_name like 'par_%%' order by 1")
+        self.assertEqual(list(range(95)), result)
+        small_pool.close()
+        db.execute_simple(f"delete from public.{table_name} where color_name like 'par_%%'")
+
+        # Empty params are a no-op
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s', [])
+        db.execute_batch(f'insert into public.{table_name} (color_name, another_value) values (%s, %s)', [])
+        self.assertEqual(25, db.get_single_result(f'select count(*) from public.{table_name}'))
+
+        # Custom row template
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s', [['abc', 'def']],
+                       template="(upper(%s), %s)")
+        result = db.get_sql_list_dicts(f"select color_name from public.{table_name} where another_value = 'def'")
+        self.assertEqual([{'color_name': 'ABC'}], result)
+
+        # execute_values accepts the placeholder without a space after values
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values%s', [['nospace', 'x']])
+        self.assertEqual(1, db.get_single_result(f"select count(*) from public.{table_name} "
+                                                 f"where color_name = 'nospace'"))
+
+        # Per row statements without 'values %s' run through execute_batch
+        db.insert_many(f'update public.{table_name} set another_value = %s where color_name = %s',
+                       [['one', 'color_1'], ['two', 'color_2']])
+        db.insert_many(f'delete from public.{table_name} where color_name = %s', [['ABC']])
+        result = db.get_sql_single_item_list(f"select another_value from public.{table_name} "
+                                             f"where color_name in ('color_1', 'color_2', 'ABC') order by id")
+        self.assertEqual(['one', 'two'], result)
+
+    def test__bulk_insert_copy(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db, True)
+        rows = [['tab\there', 'new\nline', 1, date(2021, 1, 1), datetime(2021, 1, 1, 12, 30), 1.25],
+                ['back\\slash', None, None, None, pd.NaT, np.nan]]
+        db.bulk_insert_copy(table_name, ['color_name', 'another_value', 'an_int', 'a_date', 'a_timestamp', 'a_number'],
+                            rows, schema='public')
+        res = db.get_sql_list_dicts(f'select color_name, another_value, an_int, a_date, a_timestamp, a_number '
+                                    f'from public.{table_name} order by id')
+        self.assertEqual([{'color_name': 'tab\there', 'another_value': 'new\nline', 'an_int': 1,
+                           'a_date': date(2021, 1, 1), 'a_timestamp': datetime(2021, 1, 1, 12, 30),
+                           'a_number': Decimal('1.25')},
+                          {'color_name': 'back\\slash', 'another_value': None, 'an_int': None, 'a_date': None,
+                           'a_timestamp': None, 'a_number': None}], res)
+
+        # insert_many hands large plain inserts to COPY
+        params = [[f'copy_{i}', str(i)] for i in range(20)]
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s', params,
+                       copy_threshold=5)
+        self.assertEqual(20, db.get_single_result(f"select count(*) from public.{table_name} "
+                                                  f"where color_name like 'copy%%'"))
+
+        # So does the deprecated execute_many alias
+        with self.assertWarns(DeprecationWarning):
+            db.execute_many(f'insert into public.{table_name} (color_name, another_value) values %s',
+                            [[f'many_{i}', str(i)] for i in range(20)], copy_threshold=5)
+        self.assertEqual(20, db.get_single_result(f"select count(*) from public.{table_name} "
+                                                  f"where color_name like 'many%%'"))
+
+        # A value COPY can't encode anywhere in the rows falls back to INSERT
+        params = [[f'mixed_{i}', str(i)] for i in range(20)]
+        params[-1][1] = AsIs("'literal'")
+        db.insert_many(f'insert into public.{table_name} (color_name, another_value) values %s', params,
+                       copy_threshold=5)
+        self.assertEqual('literal', db.get_single_result(f"select another_value from public.{table_name} "
+                                                         f"where color_name = 'mixed_19'"))
+
+        # Floats headed for an integer column (e.g. a pandas int column that picked up a NaN) fall back to INSERT,
+        # since COPY can't parse '0.0' as an integer. Floats for a numeric column still go through COPY.
+        params = [[f'float_{i}', float(i), i / 4] for i in range(20)]
+        self.assertFalse(db._can_copy(f'public.{table_name}', ['color_name', 'an_int', 'a_number'], params))
+        self.assertTrue(db._can_copy(table_name, ['color_name', 'a_number'], [row[::2] for row in params]))
+        db.insert_many(f'insert into public.{table_name} (color_name, an_int, a_number) values %s', params,
+                       copy_threshold=5)
+        self.assertEqual(list(range(20)), db.get_sql_single_item_list(f"select an_int from public.{table_name} "
+                                                                      f"where color_name like 'float%%' order by id"))
+
+    def test__copy_dataframe(self):
+        db = self._get_db_inst()
+        table_name = self._prepare_test_table(db, True)
+        df = pd.DataFrame({'color_name': ['tab\there', 'quote"and,comma', ''],
+                           'another_value': ['new\nline', None, 'x'],
+                           'an_int': [1, np.nan, 3],
+                           'a_timestamp': pd.to_datetime(['2021-01-01 12:30:00', None, None]),
+                           'a_number': [1.25, np.inf, np.nan]})
+        db.copy_dataframe(df, table_name, 'public', page_size=2)
+        res = db.get_sql_list_dicts(f'select color_name, another_value, an_int, a_timestamp, a_number '
+                                    f'from public.{table_name} order by id')
+        self.assertEqual([{'color_name': 'tab\there', 'another_value': 'new\nline', 'an_int': 1,
+                           'a_timestamp': datetime(2021, 1, 1, 12, 30), 'a_number': Decimal('1.25')},
+                          {'color_name': 'quote"and,comma', 'another_value': None, 'an_int': None,
+                           'a_timestamp': None, 'a_number': None},
+                          {'color_name': '', 'another_value': 'x', 'an_int': 3, 'a_timestamp': None,
+                           'a_number': None}], res)
+        # The caller's frame is left untouched
+        self.assertEqual(np.inf, df['a_number'][1])
+
+        # save_dataframe hands large frames to COPY
+        db.save_dataframe(pd.DataFrame({'color_name': [f'copy_{i}' for i in range(20)]}), table_name, 'public',
+                          copy_threshold=5)
+        self.assertEqual(20, db.get_single_result(f"select count(*) from public.{table_name} "
+                                                  f"where color_name like 'copy%%'"))
+
+        # Whole numbers too large for Int64 stay floats
+        db.execute_simple('drop table if exists public.copy_float; create table public.copy_float (a float8)')
+        db.copy_dataframe(pd.DataFrame({'a': [1e20, np.nan]}), 'copy_float', 'public')
+        self.assertEqual([1e20, None], db.get_sql_single_item_list('select a from public.copy_float order by a'))
+        db.execute_simple('drop table public.copy_float')
+
     def test__update_batch_from_df(self):
         # Update time notes: 50K in
         db = self._get_db_inst()
@@ -200,6 +587,25 @@ class TestDBManager(TestCase):
         # Make sure indexes from ~random_list have not been changed
         self.assertEqual(num_rows - len(randomlist), len(res[~res.id.isin(randomlist)]))
 
+        # Typed columns, including a column that is entirely null
+        df = pd.DataFrame({'id': [1, 2], 'an_int': [None, None], 'a_number': [1.25, np.nan],
+                           'a_date': [date(2021, 1, 1), None],
+                           'a_timestamp': pd.to_datetime(['2021-01-01 12:30:00', None])})
+        db.update_batch_from_df(df, ['an_int', 'a_number', 'a_date', 'a_timestamp'], ['id'], 'public', 'color')
+        res = db.get_sql_list_dicts(f'select an_int, a_number, a_date, a_timestamp from {table_name} '
+                                    f'where id in (1, 2) order by id')
+        self.assertEqual([{'an_int': None, 'a_number': Decimal('1.25'), 'a_date': date(2021, 1, 1),
+                           'a_timestamp': datetime(2021, 1, 1, 12, 30)},
+                          {'an_int': None, 'a_number': None, 'a_date': None, 'a_timestamp': None}], res)
+
+        # Redshift gets one update per row instead of the VALUES join
+        self.assertFalse(db._is_redshift())
+        db._redshift = True
+        df = pd.DataFrame({'id': [1, 2], 'an_int': [7, None], 'color_name': ['x', 'y']})
+        db.update_batch_from_df(df, ['an_int', 'color_name'], ['id'], 'public', 'color')
+        res = db.get_sql_list_dicts(f'select an_int, color_name from {table_name} where id in (1, 2) order by id')
+        self.assertEqual([{'an_int': 7, 'color_name': 'x'}, {'an_int': None, 'color_name': 'y'}], res)
+
     def test__set_column_value(self):
         db = self._get_db_inst()
 
@@ -289,6 +695,13 @@ class TestDBManager(TestCase):
                                                ['a_bad_column_name', 'another_value', 'an_int', 'a_date',
                                                 'a_timestamp', 'a_number', 'a_big_int', 'a_small_int'])
 
+        # Column types are cached until the cache is invalidated
+        db.execute_simple('alter table public.color add column a_new_col text')
+        with self.assertRaises(MissingDatabaseColumn):
+            db._get_table_column_dtypes('public', 'color', ['a_new_col'])
+        db.invalidate_dtype_cache()
+        self.assertDictEqual({'a_new_col': 1}, db._get_table_column_dtypes('public', 'color', ['a_new_col']))
+
         # Test finding an unknown dtype
         with self.assertRaises(MissingDTypeFromTypes):
             db = MockMissingDTypeFromTypes(debug_output_mode=True,
@@ -316,6 +729,54 @@ class TestDBManager(TestCase):
         golden = ['ivory']
         self.assertEqual(golden, params[0])
 
+        # Int columns stay ints when mixed with floats
+        df = pd.DataFrame({'an_int': [1, 2], 'a_number': [1.5, 2.5]})
+        sql, params = db.build_sql_from_dataframe(df, 'color', None)
+        self.assertEqual('insert into color (an_int,a_number) values %s;', sql)
+        self.assertEqual([[1, 1.5], [2, 2.5]], params)
+        self.assertIs(int, type(params[0][0]))
+
+        # save_dataframe only scans rows for nan and inf when the frame holds any
+        self.assertFalse(db._has_nan_or_inf(df))
+        self.assertTrue(db._has_nan_or_inf(pd.DataFrame({'a_number': [1.5, np.inf]})))
+        self.assertTrue(db._has_nan_or_inf(pd.DataFrame({'color_name': ['a', -np.inf]})))
+        self.assertTrue(db._has_nan_or_inf(pd.DataFrame({'color_name': ['a', None]})))
+        table_name = self._prepare_test_table(db, True)
+        db.save_dataframe(pd.DataFrame({'color_name': ['a', 'b'], 'a_number': [1.5, np.inf]}), table_name, 'public')
+        self.assertEqual([1.5, None], db.get_sql_single_item_list(f'select a_number::float from {table_name} '
+                                                                  f'order by id'))
+
+    def test__convert_nan_to_none(self):
+        db = self._get_db_inst()
+
+        # Multi-dimensional lists and tuples
+        params = [['a', 1, np.nan], ('b', np.inf, -np.inf), [None, pd.NaT, 2.5]]
+        golden = [['a', 1, None], ['b', None, None], [None, None, 2.5]]
+        self.assertEqual(golden, db.convert_nan_to_none(params))
+
+        # All numeric, where ints must stay ints. Strings that parse as floats are left alone.
+        params = [[1, 2.5, np.nan], [np.inf, 3, None], [4, 'nan', '1.5']]
+        golden = [[1, 2.5, None], [None, 3, None], [4, 'nan', '1.5']]
+        test = db.convert_nan_to_none(params)
+        self.assertEqual(golden, test)
+        self.assertIs(int, type(test[0][0]))
+
+        # Ragged rows take the row by row path
+        params = [['a', 1, np.nan, True], [np.inf, None, 'b'], [2.5, pd.NaT]]
+        golden = [['a', 1, None, True], [None, None, 'b'], [2.5, None]]
+        self.assertEqual(golden, db.convert_nan_to_none(params))
+
+        # Single dimension list
+        params = ['a', np.nan, 1, None]
+        golden = ['a', None, 1, None]
+        self.assertEqual(golden, db.convert_nan_to_none(params))
+
+    def test__make_variable_replacements(self):
+        db = self._get_db_inst()
+        with self.assertWarns(DeprecationWarning):
+            test = db.make_variable_replacements(['a', 'b', 'c'])
+        self.assertEqual('%s, %s, %s', test)
+
     # def test__update_db_(self):
     #     db = self._get_db_inst()
     #     table_name = self._prepare_test_table(db)